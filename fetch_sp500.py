@@ -1,45 +1,179 @@
 #!/usr/bin/env python3
 """
 Script to fetch S&P 500 ticker symbols and save to CSV
+
+Usage:
+  python fetch_sp500.py        # S&P 500 only
+  python fetch_sp500.py all    # also fetch all NASDAQ/NYSE symbols
 """
-import pandas as pd
 import os
+import json
+import time
+from datetime import timedelta
+from io import BytesIO
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.html
+
+SP500_URL = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+USER_AGENT = 'gap-down-stocks/1.0 (S&P 500 ticker fetcher)'
+
+# NASDAQ symbol directory over HTTPS (covers NASDAQ, NYSE and other US exchanges);
+# same files as ftp.nasdaqtrader.com/SymbolDirectory
+SYMBOL_DIRECTORY_URL = 'https://www.nasdaqtrader.com/dynamic/SymDir'
+SYMBOL_FILES = ['nasdaqlisted.txt', 'otherlisted.txt']
+# Only these columns are parsed; otherlisted.txt calls its symbol column 'ACT Symbol'
+SYMBOL_COLUMNS = {'Symbol', 'ACT Symbol', 'Test Issue', 'Financial Status'}
+
+# One keep-alive session for every download. requests negotiates gzip/deflate
+# by default, and brotli too when the brotli package is installed.
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': USER_AGENT})
+# Transient failures (rate limiting, 5xx, dropped connections) are retried with
+# exponential backoff, honouring Retry-After
+SESSION.mount('https://', HTTPAdapter(max_retries=Retry(
+    total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])))
+
+# Raw downloads are kept here so unchanged sources are not re-fetched
+CACHE_DIR = '.cache'
+# Listings change slowly: a cached download younger than this is used without
+# even a conditional request
+CACHE_TTL = timedelta(hours=24)
+
+def _write_atomic(path, data):
+    """Write bytes to path via a temp file so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # Raw fd writes; the payload is already bytes so no buffered/text layers are needed
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+def _load_cache_meta(cache_path):
+    """Return the validators stored alongside a cached download, if any"""
+    meta_path = f"{cache_path}.meta.json"
+    if not (os.path.exists(cache_path) and os.path.exists(meta_path)):
+        return {}
+    with open(meta_path) as f:
+        return json.load(f)
+
+def _save_cache(cache_path, data, meta):
+    _write_atomic(cache_path, data)
+    _write_atomic(f"{cache_path}.meta.json", json.dumps(meta).encode('utf-8'))
+
+def _read_cache(cache_path):
+    with open(cache_path, 'rb') as f:
+        return f.read()
+
+def _cached_get(url, cache_path):
+    """
+    GET a URL with If-None-Match/If-Modified-Since, serving the cached body on 304
+    or without any request while it is younger than CACHE_TTL.
+    Returns (body, save_cache). save_cache is None when the cached copy was reused;
+    otherwise the caller calls it to store the new body once it has been processed,
+    so a failed parse is never mistaken for an unchanged source on the next run.
+    """
+    meta = _load_cache_meta(cache_path)
+    if time.time() - meta.get('fetched_at', 0) < CACHE_TTL.total_seconds():
+        print(f"{url} cached less than {CACHE_TTL} ago, using cached copy")
+        return _read_cache(cache_path), None
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    response = SESSION.get(url, headers=headers, timeout=30)
+    if response.status_code == 304:
+        print(f"{url} unchanged, using cached copy")
+        # Restart the TTL; the body on disk is still current
+        meta['fetched_at'] = time.time()
+        _write_atomic(f"{cache_path}.meta.json", json.dumps(meta).encode('utf-8'))
+        return _read_cache(cache_path), None
+    response.raise_for_status()
+
+    meta = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.time(),
+    }
+    return response.content, lambda: _save_cache(cache_path, response.content, meta)
+
+def _download_symbol_file(file):
+    """Download one symbol directory file, reusing the cached copy if unchanged"""
+    print(f"Downloading {file}...")
+    return _cached_get(f"{SYMBOL_DIRECTORY_URL}/{file}", os.path.join(CACHE_DIR, file))
+
+def _read_symbol_table(data):
+    """Parse a '|'-delimited symbol directory file with the pyarrow CSV reader"""
+    import pandas as pd
+
+    # pyarrow needs usecols as a list, so pick the wanted columns from the header
+    header = data[:data.find(b'\n')].decode('utf-8').strip().split('|')
+    usecols = [column for column in header if column in SYMBOL_COLUMNS]
+    # BytesIO over an existing bytes object shares it rather than copying
+    return pd.read_csv(BytesIO(data), sep='|', usecols=usecols, dtype=str, engine='pyarrow')
+
+def read_tickers_csv(path):
+    """Read back a TICKER csv written by write_tickers_csv"""
+    with open(path) as f:
+        return [line for line in f.read().splitlines()[1:] if line]
+
+def write_tickers_csv(output_file, symbols):
+    """Write a single-column TICKER csv in one write call, replacing the old file atomically"""
+    payload = 'TICKER\n' + ''.join(f'{symbol}\n' for symbol in symbols)
+    _write_atomic(output_file, payload.encode('utf-8'))
 
 def fetch_sp500_symbols():
     """Fetch S&P 500 symbols from Wikipedia"""
     try:
         print("Fetching S&P 500 symbols from Wikipedia...")
 
-        # URL of the Wikipedia page containing S&P 500 companies
-        url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+        output_file = 'sp500_tickers.csv'
 
-        # Read the HTML tables from the page
-        tables = pd.read_html(url)
+        # Download the Wikipedia page containing S&P 500 companies
+        html, save_cache = _cached_get(SP500_URL, os.path.join(CACHE_DIR, 'sp500_wikipedia.html'))
 
-        # The first table contains the list of companies
-        sp500_table = tables[0]
+        # Page unchanged since the last run: the existing CSV is already current
+        if save_cache is None and os.path.exists(output_file):
+            cleaned_symbols = read_tickers_csv(output_file)
+            print(f"S&P 500 list unchanged, reusing {len(cleaned_symbols)} symbols from {output_file}")
+            return cleaned_symbols
 
-        # Extract the 'Symbol' column and clean it
-        sp500_symbols = sp500_table['Symbol'].tolist()
+        # Pull the Symbol column (first cell of each row) straight out of the
+        # constituents table instead of building DataFrames for every table
+        doc = lxml.html.fromstring(html)
+        cells = doc.xpath('//table[@id="constituents"]/tbody/tr/td[1]')
+        if not cells:
+            # Table id changed; fall back to the first wikitable whose first header is 'Symbol'
+            cells = doc.xpath('(//table[contains(@class, "wikitable")]'
+                              '[.//tr[1]/th[1][normalize-space()="Symbol"]])[1]/tbody/tr/td[1]')
+        sp500_symbols = [cell.text_content().strip() for cell in cells]
+        sp500_symbols = [symbol for symbol in sp500_symbols if symbol]
+        if not sp500_symbols:
+            raise ValueError("constituents table not found on Wikipedia page")
 
-        # Remove any symbols with dots (like BRK.B) and replace with hyphens for yfinance
-        cleaned_symbols = []
-        for symbol in sp500_symbols:
-            if '.' in symbol:
-                # Replace dots with hyphens for yfinance compatibility
-                cleaned_symbol = symbol.replace('.', '-')
-                cleaned_symbols.append(cleaned_symbol)
-            else:
-                cleaned_symbols.append(symbol)
+        # Replace dots with hyphens for yfinance compatibility (BRK.B -> BRK-B);
+        # most weeks no symbol has a dot, so skip rebuilding the list then
+        if any('.' in symbol for symbol in sp500_symbols):
+            cleaned_symbols = [symbol.replace('.', '-') for symbol in sp500_symbols]
+        else:
+            cleaned_symbols = sp500_symbols
 
         print(f"Found {len(cleaned_symbols)} S&P 500 symbols")
 
-        # Save to CSV
-        output_file = 'sp500_tickers.csv'
-        with open(output_file, 'w', newline='') as f:
-            f.write('TICKER\n')
-            for symbol in cleaned_symbols:
-                f.write(f'{symbol}\n')
+        # Save to CSV, then cache the page it was built from
+        write_tickers_csv(output_file, cleaned_symbols)
+        if save_cache:
+            save_cache()
 
         print(f"S&P 500 symbols saved to {output_file}")
         return cleaned_symbols
@@ -49,62 +183,53 @@ def fetch_sp500_symbols():
         return None
 
 def fetch_nasdaq_nyse_symbols():
-    """Fetch all NASDAQ and NYSE symbols from NASDAQ FTP"""
+    """Fetch all NASDAQ and NYSE symbols from the NASDAQ Trader symbol directory"""
     try:
-        import ftplib
-        from io import StringIO
-
-        print("Fetching NASDAQ and NYSE symbols from NASDAQ FTP...")
-
-        # FTP server details
-        ftp_server = 'ftp.nasdaqtrader.com'
-        ftp_path = '/SymbolDirectory'
-        files = ['nasdaqlisted.txt', 'otherlisted.txt']
+        from concurrent.futures import ThreadPoolExecutor
+        import numpy as np
 
-        all_symbols = []
+        print("Fetching NASDAQ and NYSE symbols from NASDAQ Trader...")
 
-        # Connect to the FTP server
-        ftp = ftplib.FTP(ftp_server)
-        ftp.login()
-
-        for file in files:
-            print(f"Downloading {file}...")
+        output_file = 'nasdaq_nyse_tickers.csv'
+        all_symbols = set()
 
-            # Change to the directory containing the files
-            ftp.cwd(ftp_path)
+        # Download both files concurrently so the requests overlap instead of
+        # running back to back
+        with ThreadPoolExecutor(max_workers=len(SYMBOL_FILES)) as executor:
+            downloads = list(executor.map(_download_symbol_file, SYMBOL_FILES))
 
-            # Retrieve the file contents
-            r = StringIO()
-            ftp.retrlines(f'RETR {file}', lambda line: r.write(line + '\n'))
-            r.seek(0)
+        # Neither file changed since the last run: skip parsing and rewriting
+        if all(save_cache is None for _, save_cache in downloads) and os.path.exists(output_file):
+            unique_symbols = read_tickers_csv(output_file)
+            print(f"Symbol directory unchanged, reusing {len(unique_symbols)} symbols from {output_file}")
+            return unique_symbols
 
+        for data, _ in downloads:
             # Read the file into a DataFrame
-            df = pd.read_csv(r, sep='|')
+            df = _read_symbol_table(data)
 
             # Filter for common stocks (exclude test issues and certain financial statuses)
+            # with one boolean mask rather than slicing the DataFrame per condition
+            mask = np.ones(len(df), dtype=bool)
             if 'Test Issue' in df.columns:
-                df = df[df['Test Issue'] == 'N']
+                mask &= df['Test Issue'].to_numpy() == 'N'
             if 'Financial Status' in df.columns:
-                df = df[df['Financial Status'].isin(['N', 'D'])]
+                mask &= np.isin(df['Financial Status'].to_numpy(), ['N', 'D'])
 
-            # Extract the symbols
-            symbols = df['Symbol'].tolist()
-            all_symbols.extend(symbols)
+            # Extract the symbols (duplicates across files collapse in the set)
+            symbol_column = 'Symbol' if 'Symbol' in df.columns else 'ACT Symbol'
+            all_symbols.update(df[symbol_column].to_numpy()[mask].tolist())
 
-        # Close the FTP connection
-        ftp.quit()
-
-        # Remove duplicates and sort
-        unique_symbols = sorted(list(set(all_symbols)))
+        # Sort the already de-duplicated symbols
+        unique_symbols = sorted(all_symbols)
 
         print(f"Found {len(unique_symbols)} total NASDAQ/NYSE symbols")
 
-        # Save to CSV
-        output_file = 'nasdaq_nyse_tickers.csv'
-        with open(output_file, 'w', newline='') as f:
-            f.write('TICKER\n')
-            for symbol in unique_symbols:
-                f.write(f'{symbol}\n')
+        # Save to CSV, then cache the files it was built from
+        write_tickers_csv(output_file, unique_symbols)
+        for _, save_cache in downloads:
+            if save_cache:
+                save_cache()
 
         print(f"NASDAQ/NYSE symbols saved to {output_file}")
         return unique_symbols
@@ -114,15 +239,27 @@ def fetch_nasdaq_nyse_symbols():
         return None
 
 if __name__ == "__main__":
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
     print("Stock Symbol Fetcher")
     print("===================")
 
-    # Fetch S&P 500 symbols
-    sp500_symbols = fetch_sp500_symbols()
+    # Pass 'all' to also fetch all NASDAQ/NYSE symbols
+    fetch_all = len(sys.argv) > 1 and sys.argv[1] == 'all'
+
+    # Both fetchers are network-bound, so run them side by side
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sp500_future = executor.submit(fetch_sp500_symbols)
+        nasdaq_nyse_future = executor.submit(fetch_nasdaq_nyse_symbols) if fetch_all else None
+
+        sp500_symbols = sp500_future.result()
+        nasdaq_nyse_symbols = nasdaq_nyse_future.result() if nasdaq_nyse_future else None
 
     if sp500_symbols:
         print(f"\nS&P 500 symbols fetched successfully!")
         print(f"First 10 symbols: {sp500_symbols[:10]}")
 
-    # Uncomment the line below to also fetch all NASDAQ/NYSE symbols
-    # nasdaq_nyse_symbols = fetch_nasdaq_nyse_symbols()
+    if nasdaq_nyse_symbols:
+        print(f"\nNASDAQ/NYSE symbols fetched successfully!")
+        print(f"First 10 symbols: {nasdaq_nyse_symbols[:10]}")
@@ -32,6 +32,7 @@ Commands:
 Environment (.env):
   TICKERS_CSV=sp500_tickers.csv
   TESTING_MODE=false    # true to limit to first 50 tickers for testing
+  MAX_TICKERS=0         # scan only the first N tickers (0 = all; defaults to 50 in TESTING_MODE)
   MIN_GAP_DOWN_PCT=-5   # negative number, e.g., -5 means -5% or worse
   MIN_GAP_UP_PCT=1      # positive number, e.g., 1 means +1% or better
   RESEND_API_KEY=re_xxxxxx
@@ -49,16 +50,53 @@ Notes:
 """
 import os
 import sys
-import math
 import time
-import json
-import csv
+import io
 import base64
-from datetime import datetime, date, timedelta, timezone
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import numpy as np
+import orjson
 import pandas as pd
-import pytz
+import requests
+import resend
+import urllib3
+import yfinance as yf
 
+from curl_cffi import requests as curl_requests
 from dotenv import load_dotenv
+from tqdm import tqdm
+from xlsxwriter.utility import xl_col_to_name
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar, Holiday, GoodFriday, USLaborDay, USMartinLutherKingJr,
+    USMemorialDay, USPresidentsDay, USThanksgivingDay, nearest_workday, sunday_to_monday,
+)
+
+# Set User-Agent to avoid being blocked by Yahoo Finance
+yf.utils.get_user_agent = lambda: 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# US market timezone used for all timestamps
+ET_TZ = ZoneInfo('America/New_York')
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Full-day NYSE market closures"""
+    rules = [
+        Holiday('New Years Day', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-06-19', observance=nearest_workday),
+        Holiday('Independence Day', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ]
+
+NYSE_CALENDAR = NYSEHolidayCalendar()
 
 def get_personal_emails(cfg):
     """Get personal/default email recipients from PERSONAL_EMAILS environment variable"""
@@ -74,6 +112,170 @@ def get_all_recipients(cfg):
         return []
     return [email.strip() for email in receiver_emails.split(",") if email.strip()]
 
+# Worker threads yf.download uses to fetch the symbols of one call. Its default
+# (2 x CPU count) is only 2 on a shared-cpu-1x VM. yf.download keeps results in
+# module-level state, so concurrency comes from here rather than from wrapping
+# several download calls in our own thread pool.
+YF_MAX_WORKERS = 16
+# Yahoo chart endpoint queried directly for each ticker's latest minute price
+CHART_URL = 'https://query1.finance.yahoo.com/v8/finance/chart/{}'
+# Minute-price requests in flight at once
+CHART_MAX_CONCURRENCY = 20
+# Minute-price requests started per second; up to CHART_MAX_CONCURRENCY can
+# start back to back before the limit applies
+CHART_REQUESTS_PER_SECOND = 50
+# On a 429 the rate is halved (down to the floor), then raised by
+# CHART_RATE_STEP per successful response until it is back at the ceiling
+CHART_MIN_REQUESTS_PER_SECOND = 2
+CHART_RATE_STEP = 0.5
+# Attempts per minute-price request; rate-limited (429) and 5xx responses and
+# network errors are retried with exponential backoff plus jitter
+CHART_MAX_ATTEMPTS = 3
+CHART_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest Retry-After (seconds) honoured before a minute-price request is abandoned
+CHART_MAX_RETRY_AFTER = 30
+
+# Previous closes from earlier runs, keyed by the trading day they closed on
+PREV_CLOSE_CACHE = os.path.join('.cache', 'prev_closes.parquet')
+
+def _load_prev_close_cache(trading_day):
+    """Return {ticker: close} cached for trading_day, or {} if there is none"""
+    try:
+        cached = pd.read_parquet(PREV_CLOSE_CACHE)
+        cached = cached[cached["date"] == trading_day.isoformat()]
+        return dict(zip(cached["ticker"], cached["close"]))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        # Unreadable cache (missing Parquet engine, corrupt file, old schema): download everything
+        print(f"Could not load previous close cache: {e}")
+        return {}
+
+def _save_prev_close_cache(trading_day, closes):
+    """Persist {ticker: close} for trading_day, replacing any older entries"""
+    os.makedirs(os.path.dirname(PREV_CLOSE_CACHE), exist_ok=True)
+    tmp_path = PREV_CLOSE_CACHE + '.tmp'
+    pd.DataFrame({
+        "ticker": list(closes),
+        "date": trading_day.isoformat(),
+        "close": list(closes.values()),
+    }).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, PREV_CLOSE_CACHE)
+
+# Latest scan results per ET day, overwritten by later runs on the same day
+RESULTS_PATH = os.path.join('.cache', 'gap_analysis_{:%Y%m%d}.parquet')
+
+# HTTP session shared by every yfinance request so TLS connections are reused
+_YF_SESSION = None
+
+def _yf_session():
+    """Return the shared keep-alive session passed to yf.download"""
+    global _YF_SESSION
+    if _YF_SESSION is None:
+        # yfinance only accepts curl_cffi sessions; impersonating Chrome avoids Yahoo's bot blocking
+        _YF_SESSION = curl_requests.Session(impersonate="chrome")
+    return _YF_SESSION
+
+class _TokenBucket:
+    """Async limiter allowing `rate` acquisitions per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.last_cut = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Callers queue on the lock so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttled(self):
+        """Halve the rate after a rate-limited response"""
+        # Requests already in flight tend to be rejected together; count them as one signal
+        now = time.monotonic()
+        if now - self.last_cut < 1:
+            return
+        self.last_cut = now
+        self.rate = max(CHART_MIN_REQUESTS_PER_SECOND, self.rate / 2)
+
+    def succeeded(self):
+        """Creep the rate back toward its ceiling after a successful response"""
+        self.rate = min(self.max_rate, self.rate + CHART_RATE_STEP)
+
+async def _fetch_latest_minute_price(session, semaphore, limiter, ticker):
+    """Return the close of ticker's most recent 1-minute bar, pre/post-market included"""
+    # range=1d is the latest session (today's once pre-market opens); nothing older is needed
+    for attempt in range(1, CHART_MAX_ATTEMPTS + 1):
+        try:
+            async with semaphore:
+                await limiter.acquire()
+                response = await session.get(CHART_URL.format(ticker),
+                                             params={"range": "1d", "interval": "1m", "includePrePost": "true"})
+            if response.status_code == 429:
+                limiter.throttled()
+            elif response.status_code == 200:
+                limiter.succeeded()
+            if response.status_code not in CHART_RETRY_STATUSES or attempt == CHART_MAX_ATTEMPTS:
+                break
+            retry_after = response.headers.get("Retry-After", "")
+            # Asked to wait longer than we will: give up on this ticker (it falls back to the daily close)
+            if retry_after.isdigit() and int(retry_after) > CHART_MAX_RETRY_AFTER:
+                break
+        except curl_requests.RequestsError:
+            if attempt == CHART_MAX_ATTEMPTS:
+                raise
+            retry_after = ""
+        # Sleep outside the semaphore so other tickers keep downloading; honour
+        # Retry-After (seconds) when the server sends a longer wait
+        delay = 2 ** (attempt - 1) + random.uniform(0, 1)
+        if retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        await asyncio.sleep(delay)
+    response.raise_for_status()
+    # Each body holds a full session of extended-hours minute bars; orjson parses it several times faster than json
+    result = orjson.loads(response.content)["chart"]["result"][0]
+    # Missing bars come back as null, which NumPy turns into NaN
+    closes = np.array(result["indicators"]["quote"][0]["close"], dtype=float)
+    closes = closes[~np.isnan(closes)]
+    return float(closes[-1]) if len(closes) else None
+
+async def _fetch_latest_minute_prices(tickers, progress):
+    """Return {ticker: latest minute price} for every ticker Yahoo has minute data for"""
+    semaphore = asyncio.Semaphore(CHART_MAX_CONCURRENCY)
+    limiter = _TokenBucket(CHART_REQUESTS_PER_SECOND, CHART_MAX_CONCURRENCY)
+    async with curl_requests.AsyncSession(impersonate="chrome", timeout=30,
+                                          max_clients=CHART_MAX_CONCURRENCY) as session:
+        async def fetch(ticker):
+            try:
+                return await _fetch_latest_minute_price(session, semaphore, limiter, ticker)
+            finally:
+                progress.update(1)
+
+        prices = await asyncio.gather(*(fetch(t) for t in tickers), return_exceptions=True)
+    return {t: price for t, price in zip(tickers, prices) if isinstance(price, float)}
+
+def previous_trading_day(now_et):
+    """Return the date of the market close that current prices are compared against"""
+    # Always use the last trading day before today, even after today's 4pm close,
+    # for consistency since we're comparing current price vs "previous close":
+    # For Sunday: Friday close (no Saturday trading)
+    # For Monday: Friday close
+    # For the day after a market holiday: the close before the holiday
+    today = np.datetime64(now_et.date(), 'D')
+    holidays = NYSE_CALENDAR.holidays(start=str(today - 30), end=str(today)).values.astype('datetime64[D]')
+    return np.busday_offset(today - 1, 0, roll='backward', holidays=holidays).item()
+
 def pct(x):
     return f"{x:.2f}%"
 
@@ -86,16 +288,22 @@ def load_env():
         "MIN_GAP_DOWN_PCT": float(os.getenv("MIN_GAP_DOWN_PCT", "-5")),
         "MIN_GAP_UP_PCT": float(os.getenv("MIN_GAP_UP_PCT", "1")),
         "TESTING_MODE": os.getenv("TESTING_MODE", "false").lower() == "true",
+        "DEBUG_SAVE_XLSX": os.getenv("DEBUG_SAVE_XLSX", "false").lower() == "true",
+        "DEBUG_CSV": os.getenv("DEBUG_CSV", "false").lower() == "true",
+        "FORCE_REFRESH": os.getenv("FORCE_REFRESH", "false").lower() == "true",
+        "SKIP_EMPTY_REPORTS": os.getenv("SKIP_EMPTY_REPORTS", "false").lower() == "true",
         "RESEND_API_KEY": os.getenv("RESEND_API_KEY", ""),
         "EMAIL_FROM": os.getenv("EMAIL_FROM", ""),
         "PERSONAL_EMAILS": os.getenv("PERSONAL_EMAILS", ""),
         "RECEIVER_EMAIL_ADDRESS": os.getenv("RECEIVER_EMAIL_ADDRESS", ""),
         "EMAIL_SUBJECT_PREFIX": os.getenv("EMAIL_SUBJECT_PREFIX", "[Gap Down]"),
     }
+    cfg["MAX_TICKERS"] = int(os.getenv("MAX_TICKERS", "50" if cfg["TESTING_MODE"] else "0"))
 
     # Print config status (without revealing actual keys)
     print(f"TICKERS_CSV: {cfg['TICKERS_CSV']}")
     print(f"TESTING_MODE: {cfg['TESTING_MODE']}")
+    print(f"MAX_TICKERS: {cfg['MAX_TICKERS'] or 'ALL'}")
     print(f"GAP_DOWN_THRESHOLD: {cfg['MIN_GAP_DOWN_PCT']}%")
     print(f"GAP_UP_THRESHOLD: {cfg['MIN_GAP_UP_PCT']}%")
     print(f"RESEND_API_KEY: {'SET' if cfg['RESEND_API_KEY'] else 'NOT SET'}")
@@ -113,191 +321,173 @@ def load_env():
 
 
 
-def get_current_price(ticker):
-    """
-    Get the current price for a ticker at the current timestamp.
-    If markets are closed (weekends, after hours), gets the most recent available price.
-    """
-    try:
-        import yfinance as yf
-        import pytz
-
-        # Set User-Agent to avoid being blocked by Yahoo Finance
-        yf.utils.get_user_agent = lambda: 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-
-        et_tz = pytz.timezone('US/Eastern')
-        now_et = datetime.now(et_tz)
-
-        # Get recent data to find the most current price available
-        # Use 1-minute data for current day, and daily data as fallback
-
-        # Try to get recent minute data first (for intraday/overnight pricing)
+def _download_daily(tickers):
+    """Return 5 days of daily bars for tickers grouped by ticker, or None if nothing downloaded"""
+    df_daily = None
+    pending = tickers
+    # Bulk download, then one retry limited to the symbols it came back without
+    for attempt in range(2):
+        if not pending:
+            break
+        if attempt:
+            tqdm.write(f"Retrying daily download for {len(pending)} missing tickers...")
         try:
-            # Get last 5 days of minute data to capture weekend/overnight sessions
-            df_minute = yf.download(ticker, period="5d", interval="1m",
-                                   auto_adjust=False, progress=False, prepost=True)
-
-            if df_minute is not None and len(df_minute) > 0:
-                # Get the most recent price from minute data
-                latest_idx = df_minute.index[-1]
-                latest_row = df_minute.iloc[-1]
-
-                # Convert timestamp to ET
-                if latest_idx.tz is None:
-                    latest_idx = pytz.UTC.localize(latest_idx)
-                latest_timestamp_et = latest_idx.astimezone(et_tz)
-
-                # Get the close price from the most recent minute
-                if isinstance(df_minute.columns, pd.MultiIndex):
-                    current_price = latest_row[('Close', ticker)]
-                else:
-                    current_price = latest_row['Close']
-
-                if pd.notna(current_price):
-                    return {
-                        'price': float(current_price),
-                        'timestamp': latest_timestamp_et,
-                        'source': 'current-minute',
-                        'date': latest_timestamp_et.date()
-                    }
-
-        except Exception:
-            # Fallback to daily data if minute data fails
-            pass
-
-        # Fallback: Get daily data for most recent close
-        df_daily = yf.download(ticker, period="5d", interval="1d",
-                              auto_adjust=False, progress=False)
-
-        if df_daily is not None and len(df_daily) > 0:
-            # Get the most recent trading day's close
-            latest_close = float(df_daily["Close"].iloc[-1].iloc[0] if hasattr(df_daily["Close"].iloc[-1], 'iloc') else df_daily["Close"].iloc[-1])
-            latest_date = df_daily.index[-1].date()
-
-            return {
-                'price': latest_close,
-                'timestamp': now_et,  # Current time when we fetched it
-                'source': 'daily-close',
-                'date': latest_date
-            }
+            frame = yf.download(pending, period="5d", interval="1d", group_by="ticker",
+                                auto_adjust=False, progress=False, threads=YF_MAX_WORKERS,
+                                session=_yf_session())
+        except Exception as e:
+            tqdm.write(f"Daily download failed: {e}")
+            continue
+        if frame.empty:
+            tqdm.write("Daily download returned no data")
+            continue
+        if df_daily is None:
+            df_daily = frame
+        else:
+            # Replace the failed (all-NaN) columns with the retried ones
+            df_daily = pd.concat([df_daily.drop(columns=pending, level=0, errors='ignore'), frame], axis=1)
+        # yfinance leaves a symbol out, or fills it with NaN, when its request fails
+        has_close = df_daily.xs("Close", level=1, axis=1).notna().any()
+        pending = [t for t in pending if not has_close.get(t, False)]
+    return df_daily
 
-        return None
-
-    except Exception as e:
-        print(f"Current price fetch error for {ticker}: {e}")
-        return None
 
 def yahoo_gap_scan(cfg):
     # Use yfinance with tickers from CSV file
-    import yfinance as yf
-    import pandas as pd
-
-    # Set User-Agent to avoid being blocked by Yahoo Finance
-    yf.utils.get_user_agent = lambda: 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-
-    # Use CSV file
     csv_path = cfg["TICKERS_CSV"]
     if not os.path.exists(csv_path):
         print(f"ERROR: TICKERS_CSV not found: {csv_path}", file=sys.stderr)
         sys.exit(2)
 
-    tickers = []
-    seen_tickers = set()
-    with open(csv_path, "r", newline="") as f:
-        for row in csv.reader(f):
-            if not row:
-                continue
-            t = row[0].strip().upper()
-            # Replace . with - for Yahoo Finance compatibility (BRK.B -> BRK-B)
-            t = t.replace('.', '-')
-            if t and t != "TICKER" and t not in seen_tickers:
-                tickers.append(t)
-                seen_tickers.add(t)
-
-    # Apply testing mode if enabled
-    if cfg.get('TESTING_MODE', False):
+    # na_filter=False keeps symbols such as NA as strings instead of NaN
+    symbols = pd.read_csv(csv_path, header=None, usecols=[0], names=["ticker"],
+                          dtype=str, na_filter=False)["ticker"]
+    # Replace . with - for Yahoo Finance compatibility (BRK.B -> BRK-B)
+    symbols = symbols.str.strip().str.upper().str.replace('.', '-', regex=False)
+    # drop_duplicates keeps file order
+    tickers = symbols[(symbols != "") & (symbols != "TICKER")].drop_duplicates().tolist()
+
+    # Apply ticker limit if set (TESTING_MODE defaults it to 50)
+    if cfg["MAX_TICKERS"]:
         original_count = len(tickers)
-        tickers = tickers[:50]
-        print(f"TESTING MODE: Using first {len(tickers)} tickers out of {original_count} total")
+        tickers = tickers[:cfg["MAX_TICKERS"]]
+        print(f"MAX_TICKERS: Using first {len(tickers)} tickers out of {original_count} total")
 
     mode_text = " (TESTING MODE - LIMITED SET)" if cfg.get('TESTING_MODE', False) else ""
     print(f"Scanning {len(tickers)} tickers for gap opportunities...{mode_text}")
 
-    all_data = []  # Store all stock data for CSV
-    gap_down_rows = []  # Store gap-down stocks
-    gap_up_rows = []  # Store gap-up stocks
-    successful_downloads = 0
-    failed_downloads = 0
-
-    # Process each ticker: get yesterday's close vs today's configured time price
-    for i, t in enumerate(tickers, 1):
+    # Previous closes already fetched by an earlier run today need no daily download.
+    # Cached and downloaded closes are both the close on prev_day (daily bars after it
+    # are dropped below), so every run compares against the same close. FORCE_REFRESH
+    # re-downloads anyway (the fresh closes then overwrite the cache)
+    now_et = datetime.now(ET_TZ)
+    prev_day = previous_trading_day(now_et)
+    cached_closes = {} if cfg["FORCE_REFRESH"] else _load_prev_close_cache(prev_day)
+    if cached_closes:
+        print(f"Loaded {len(cached_closes)} cached previous closes for {prev_day}")
+
+    # Previous closes share the same period/interval for every ticker, so all
+    # uncached tickers go into one bulk daily download. It runs on a worker
+    # thread while the minute prices for every ticker are fetched concurrently
+    need_daily = [t for t in tickers if t not in cached_closes]
+
+    async def fetch_all():
+        return await asyncio.gather(asyncio.to_thread(_download_daily, need_daily),
+                                    _fetch_latest_minute_prices(tickers, progress))
+
+    # The bar redraws in place on a terminal and is disabled when output is not a TTY (cron, fly logs)
+    progress = tqdm(total=len(tickers), desc="Minute prices", unit="ticker", disable=None)
+    df_daily, latest_prices = asyncio.run(fetch_all())
+    progress.close()
+    print(f"Minute prices found for {len(latest_prices)}/{len(tickers)} tickers")
+
+    # The previous close is each ticker's last close on or before prev_day, the
+    # weekday-before-today close the email reports. Bars dated after it (today's
+    # close on an evening run) are dropped so fresh and cached closes agree
+    # For Sunday evening, this would be Friday's close (since no Saturday trading)
+    # For Monday, this would still be Friday's close even after Monday's market closes
+    daily_prev = pd.Series(dtype=float)
+    new_closes = {}
+    closes = None
+    if df_daily is not None:
+        closes = df_daily.xs("Close", level=1, axis=1).loc[:str(prev_day)]
+    if closes is not None and len(closes):
+        valid = closes.notna().to_numpy()
+        # Row of each column's last non-NaN close, found for all tickers at once
+        last_row = len(valid) - 1 - valid[::-1].argmax(axis=0)
+        has_close = valid.any(axis=0)
+        daily_prev = pd.Series(closes.to_numpy()[last_row, np.arange(len(last_row))],
+                               index=closes.columns)[has_close]
+        close_dates = pd.Series(closes.index[last_row].date, index=closes.columns)[has_close]
+        # Only cache closes from prev_day itself; an older bar (e.g. a halted
+        # ticker) is used for this run but not kept
+        new_closes = daily_prev[close_dates == prev_day].to_dict()
+
+    prev_close = pd.Series(cached_closes, dtype=float).combine_first(daily_prev).reindex(tickers)
+    # Get current price (most recent available price); with no minute data
+    # the ticker falls back to its previous close (a 0% gap)
+    current = pd.Series(latest_prices, dtype=float).reindex(tickers)
+
+    if new_closes:
         try:
-            # Progress indicator
-            if i % 100 == 0 or i == len(tickers):
-                print(f"Progress: {i}/{len(tickers)} ({i/len(tickers)*100:.1f}%) - Gap Downs: {len(gap_down_rows)}, Gap Ups: {len(gap_up_rows)}")
-
-            # Add a small delay to avoid rate limiting
-            time.sleep(0.1)
-
-            # Get recent daily data to extract the most recent market close
-            df = yf.download(t, period="5d", interval="1d", auto_adjust=False, progress=False)
-            if df is None or len(df) < 1:
-                failed_downloads += 1
-                continue
-
-            # The most recent row in daily data represents the most recent market close
-            # For Sunday evening, this would be Friday's close (since no Saturday trading)
-            # For Monday, this would still be Friday's close until Monday's market closes
-            prev_close_price = float(df["Close"].iloc[-1].iloc[0] if hasattr(df["Close"].iloc[-1], 'iloc') else df["Close"].iloc[-1])
-
-            # Get current price (most recent available price)
-            current_price_data = get_current_price(t)
-            if current_price_data:
-                today_current_price = current_price_data['price']
-                data_source = current_price_data['source']
-            else:
-                # Fallback to daily open if current price unavailable
-                today_current_price = float(df["Open"].iloc[-1].iloc[0] if hasattr(df["Open"].iloc[-1], 'iloc') else df["Open"].iloc[-1])
-                data_source = 'daily-fallback'
-
-            # Calculate gap percentage (current price vs previous close)
-            gap_pct = (today_current_price - prev_close_price) / prev_close_price * 100.0
-            successful_downloads += 1
-
-            # Create stock data entry
-            stock_data = {
-                "ticker": t,
-                "name": "",
-                "prev_close": prev_close_price,
-                "today_current": today_current_price,
-                "gap_pct": gap_pct,
-                "data_source": data_source,
-            }
-
-            all_data.append(stock_data)
-
-            # Categorize based on gap thresholds
-            if gap_pct <= cfg["MIN_GAP_DOWN_PCT"]:
-                gap_down_rows.append(stock_data)
-                if len(gap_down_rows) <= 10:  # Show first 10 gap downs
-                    print(f"GAP DOWN: {t} ${prev_close_price:.2f} → ${today_current_price:.2f} ({gap_pct:+.2f}%)")
-            elif gap_pct >= cfg["MIN_GAP_UP_PCT"]:
-                gap_up_rows.append(stock_data)
-                if len(gap_up_rows) <= 10:  # Show first 10 gap ups
-                    print(f"GAP UP: {t} ${prev_close_price:.2f} → ${today_current_price:.2f} ({gap_pct:+.2f}%)")
-
+            _save_prev_close_cache(prev_day, {**cached_closes, **new_closes})
         except Exception as e:
-            failed_downloads += 1
-            if failed_downloads <= 5:
-                print(f"Skipping {t}: {e}")
+            print(f"Could not save previous close cache: {e}")
+
+    # Build all stock data column-wise and compute dollar change and gap
+    # percentage (current price vs previous close) in one vectorized pass
+    all_data = pd.DataFrame({
+        "ticker": tickers,
+        "prev_close": prev_close.to_numpy(),
+        "today_current": current.fillna(prev_close).to_numpy(),
+        "data_source": np.where(current.notna(), 'current-minute', 'daily-close'),
+    })
+    # Tickers without a usable previous close failed to download; a zero close
+    # would divide by zero below, so it is dropped by the same mask
+    prev = all_data["prev_close"].to_numpy()
+    valid = np.isfinite(prev) & np.isfinite(all_data["today_current"].to_numpy()) & (prev > 0)
+    all_data = all_data[valid].reset_index(drop=True)
+    successful_downloads = len(all_data)
+    failed_downloads = len(tickers) - successful_downloads
+
+    prev = all_data["prev_close"].to_numpy(dtype=np.float64)
+    cur = all_data["today_current"].to_numpy(dtype=np.float64)
+    all_data["dollar_change"] = cur - prev
+    all_data["gap_pct"] = (cur - prev) / prev * 100.0
+
+    # Tickers are already unique from the CSV load, so rows only need sorting (most negative first)
+    all_data = all_data.sort_values("gap_pct", ignore_index=True)
+
+    # Keep a typed copy of today's results for programmatic reuse (re-analysis, reruns)
+    try:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        all_data.to_parquet(RESULTS_PATH.format(now_et), compression='zstd', index=False)
+    except Exception as e:
+        print(f"Could not save scan results: {e}")
+
+    # Categorize based on gap thresholds
+    gap_down_thr = cfg["MIN_GAP_DOWN_PCT"]
+    gap_up_thr = cfg["MIN_GAP_UP_PCT"]
+    is_gap_down = all_data["gap_pct"] <= gap_down_thr
+    is_gap_up = ~is_gap_down & (all_data["gap_pct"] >= gap_up_thr)
+    gap_downs = all_data[is_gap_down].reset_index(drop=True)  # most negative first
+    gap_ups = all_data[is_gap_up].iloc[::-1].reset_index(drop=True)  # most positive first
+
+    # Show the first 10 gap downs and gap ups, written to stdout in one call
+    top_lines = [f"GAP DOWN: {row.ticker} ${row.prev_close:.2f} → ${row.today_current:.2f} ({row.gap_pct:+.2f}%)"
+                 for row in gap_downs.head(10).itertuples(index=False)]
+    top_lines += [f"GAP UP: {row.ticker} ${row.prev_close:.2f} → ${row.today_current:.2f} ({row.gap_pct:+.2f}%)"
+                  for row in gap_ups.head(10).itertuples(index=False)]
+    if top_lines:
+        print("\n".join(top_lines))
 
     print(f"\n{'='*80}")
     print(f"SCAN RESULTS SUMMARY")
     print(f"{'='*80}")
     print(f"Successfully processed: {successful_downloads} tickers")
     print(f"Failed downloads: {failed_downloads} tickers")
-    print(f"Gap-down stocks found (≤{cfg['MIN_GAP_DOWN_PCT']}%): {len(gap_down_rows)}")
-    print(f"Gap-up stocks found (≥{cfg['MIN_GAP_UP_PCT']}%): {len(gap_up_rows)}")
+    print(f"Gap-down stocks found (≤{gap_down_thr}%): {len(gap_downs)}")
+    print(f"Gap-up stocks found (≥{gap_up_thr}%): {len(gap_ups)}")
     print(f"{'='*80}\n")
 
     # Early exit check
@@ -305,133 +495,136 @@ def yahoo_gap_scan(cfg):
         print("ERROR: No stocks were successfully processed. Cannot send email.", file=sys.stderr)
         return None
 
-    # Remove duplicates based on ticker (keep first occurrence)
-    seen_tickers = set()
-    unique_all_data = []
-    for stock in all_data:
-        if stock['ticker'] not in seen_tickers:
-            unique_all_data.append(stock)
-            seen_tickers.add(stock['ticker'])
-
-    # Remove duplicates from gap lists too
-    seen_gap_down = set()
-    unique_gap_downs = []
-    for stock in gap_down_rows:
-        if stock['ticker'] not in seen_gap_down:
-            unique_gap_downs.append(stock)
-            seen_gap_down.add(stock['ticker'])
-
-    seen_gap_up = set()
-    unique_gap_ups = []
-    for stock in gap_up_rows:
-        if stock['ticker'] not in seen_gap_up:
-            unique_gap_ups.append(stock)
-            seen_gap_up.add(stock['ticker'])
-
-    # Sort the data
-    unique_gap_downs.sort(key=lambda x: x["gap_pct"])  # most negative first
-    unique_gap_ups.sort(key=lambda x: x["gap_pct"], reverse=True)  # most positive first
-    unique_all_data.sort(key=lambda x: x["gap_pct"])  # most negative first
-
     # Display summary of current price data sources
-    current_minute_count = len([s for s in unique_all_data if s.get('data_source') == 'current-minute'])
-    daily_close_count = len([s for s in unique_all_data if s.get('data_source') == 'daily-close'])
-    daily_fallback_count = len([s for s in unique_all_data if s.get('data_source') == 'daily-fallback'])
-    print(f"Data source breakdown: Current minute: {current_minute_count} | Daily close: {daily_close_count} | Daily fallback: {daily_fallback_count}")
+    source_counts = all_data["data_source"].value_counts()
+    print(f"Data source breakdown: Current minute: {source_counts.get('current-minute', 0)} | Daily close: {source_counts.get('daily-close', 0)}")
 
     return {
-        "gap_downs": unique_gap_downs,
-        "gap_ups": unique_gap_ups,
-        "all_data": unique_all_data
+        "gap_downs": gap_downs,
+        "gap_ups": gap_ups,
+        "all_data": all_data,
+        # Scan time and the close it was compared against, reused by the email
+        "now_et": now_et,
+        "prev_trading_day": prev_day,
     }
 
 
+# Attempts per email send. Only failures raised before the request reached Resend
+# (connect timeout, refused connection, DNS) are retried with exponential backoff:
+# a read timeout or dropped connection may come after Resend accepted the email,
+# and resending would deliver the report to every recipient twice
+RESEND_MAX_ATTEMPTS = 4
+
+def _failed_before_sending(error):
+    """Return True if a requests error was raised before the request was sent"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # Refused connections and DNS failures surface as MaxRetryError(reason=NewConnectionError)
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+def _send_with_retry(params):
+    """Send params through Resend, retrying failures that happened before sending"""
+    for attempt in range(1, RESEND_MAX_ATTEMPTS + 1):
+        try:
+            return resend.Emails.send(params)
+        except requests.ConnectionError as e:
+            if attempt == RESEND_MAX_ATTEMPTS or not _failed_before_sending(e):
+                raise
+            delay = 2 ** attempt + random.uniform(0, 1)
+            print(f"Email send failed before reaching Resend ({e}); retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
+# HTML cell colors for negative, zero and positive values
+SIGN_COLORS = np.array(["red", "black", "green"], dtype=object)
+
+def _build_excel_bytes(display_df, gap_down_thr, gap_up_thr):
+    """Return display_df as xlsx bytes with gap down rows red and gap up rows green"""
+    # Rows are highlighted by two conditional format rules on the Gap_Percent
+    # column rather than by styling every cell. Gap_Percent holds the unrounded
+    # gap and is only displayed to 2 decimals, so the rules see the same value
+    # the email's gap counts and tables were classified by
+    excel_buffer = io.BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        display_df.to_excel(writer, index=False, sheet_name='Sheet1')
+        worksheet = writer.sheets['Sheet1']
+        gap_idx = display_df.columns.get_loc('Gap_Percent')
+        gap_col = xl_col_to_name(gap_idx)
+        worksheet.set_column(gap_idx, gap_idx, None, writer.book.add_format({'num_format': '0.00'}))
+        last_row, last_col = len(display_df), len(display_df.columns) - 1
+        red = writer.book.add_format({'bg_color': '#ffcccc'})
+        green = writer.book.add_format({'bg_color': '#ccffcc'})
+        worksheet.conditional_format(1, 0, last_row, last_col, {
+            'type': 'formula', 'criteria': f'=${gap_col}2<={gap_down_thr}', 'format': red,
+        })
+        worksheet.conditional_format(1, 0, last_row, last_col, {
+            'type': 'formula', 'criteria': f'=${gap_col}2>={gap_up_thr}', 'format': green,
+        })
+    return excel_buffer.getvalue()
+
 def send_email(cfg, data, to_emails=None):
     # Use Resend to send HTML tables and CSV attachment
-    import resend
-    import csv
-    import io
-    from datetime import datetime
-
-    gap_downs = data.get("gap_downs", [])
-    gap_ups = data.get("gap_ups", [])
-    all_data = data.get("all_data", [])
+    gap_downs = data.get("gap_downs", pd.DataFrame())
+    gap_ups = data.get("gap_ups", pd.DataFrame())
+    all_data = data.get("all_data", pd.DataFrame())
+    # One run timestamp (the scan's, in ET) for the subject, body and file names,
+    # so every date in the report agrees even if the send is retried after midnight
+    now_et = data.get("now_et") or datetime.now(ET_TZ)
+    date_str = now_et.strftime('%Y%m%d')
 
     def build_html_table(rows, title, color_threshold=0):
-        if not rows:
+        if rows.empty:
             return f"<h3>{title}</h3><p>No stocks found.</p>"
 
-        ths = ["Ticker", "Prev Close", "Today Current", "$ Change", "Gap %"]
-        trs = []
-        for r in rows:
-            dollar_change = r['today_current'] - r['prev_close']
-            gap_color = "red" if r['gap_pct'] < color_threshold else "green" if r['gap_pct'] > color_threshold else "black"
-            change_color = "red" if dollar_change < 0 else "green" if dollar_change > 0 else "black"
-            trs.append(
-                f"<tr>"
-                f"<td><b>{r['ticker']}</b></td>"
-                f"<td>${r['prev_close']:.2f}</td>"
-                f"<td>${r['today_current']:.2f}</td>"
-                f"<td style='color:{change_color}'>${dollar_change:+.2f}</td>"
-                f"<td style='color:{gap_color}'>{r['gap_pct']:+.2f}%</td>"
-                f"</tr>"
-            )
-        html_table = (
-            "<table border='1' cellpadding='6' cellspacing='0' style='border-collapse:collapse; margin-bottom:20px;'>"
-            "<thead><tr>" + "".join([f"<th>{h}</th>" for h in ths]) + "</tr></thead>"
-            "<tbody>" + "".join(trs) + "</tbody></table>"
+        # Pick cell colors for the whole column at once by indexing with sign + 1
+        gap_sign = np.sign(rows["gap_pct"].to_numpy() - color_threshold).astype(int)
+        change_sign = np.sign(rows["dollar_change"].to_numpy()).astype(int)
+        gap_colors = pd.Series(SIGN_COLORS[gap_sign + 1], index=rows.index)
+        change_colors = pd.Series(SIGN_COLORS[change_sign + 1], index=rows.index)
+
+        # Colors are inlined per cell: email clients such as Gmail strip the
+        # id-based <style> block a pandas Styler would emit
+        table = pd.DataFrame({
+            "Ticker": "<b>" + rows["ticker"] + "</b>",
+            "Prev Close": rows["prev_close"].map("${:.2f}".format),
+            "Today Current": rows["today_current"].map("${:.2f}".format),
+            "$ Change": "<span style='color:" + change_colors + "'>" + rows["dollar_change"].map("${:+.2f}".format) + "</span>",
+            "Gap %": "<span style='color:" + gap_colors + "'>" + rows["gap_pct"].map("{:+.2f}%".format) + "</span>",
+        })
+        html_table = table.to_html(index=False, escape=False, border=1).replace(
+            '<table border="1" class="dataframe">',
+            "<table border='1' cellpadding='6' cellspacing='0' style='border-collapse:collapse; margin-bottom:20px;'>",
+            1,
         )
         return f"<h3>{title} ({len(rows)} stocks)</h3>" + html_table
 
-    # Build HTML content with current timestamp info
-    et_tz = pytz.timezone('US/Eastern')
-    now_et = datetime.now(et_tz)
-
-    # Find the most recent market close day
-    # This should be the most recent day when markets actually closed at 4pm ET
-    # For Sunday: Friday close (no Saturday trading)
-    # For Monday before 4pm: Friday close (Monday hasn't closed yet)
-    # For Monday after 4pm: Monday close (Monday has closed)
-
-    # Start from today and work backwards to find the most recent trading day that has closed
-    previous_trading_day = now_et.date()
-
-    # If today is a weekend, go back to the most recent trading day
-    while previous_trading_day.weekday() >= 5:  # Saturday=5, Sunday=6
-        previous_trading_day = previous_trading_day - timedelta(days=1)
-
-    # If today is a weekday, we need to decide:
-    # - If markets haven't closed today yet (before 4pm), use previous day's close
-    # - If markets have closed today (after 4pm), use today's close
-    # For simplicity, let's always use the previous trading day's close for consistency
-    # since we're comparing current price vs "previous close"
-    if now_et.weekday() < 5:  # If today is a weekday
-        previous_trading_day = previous_trading_day - timedelta(days=1)
-        while previous_trading_day.weekday() >= 5:  # Skip weekends
-            previous_trading_day = previous_trading_day - timedelta(days=1)
-
-    # Format the timestamps for display
-    current_time_str = now_et.strftime('%A, %Y-%m-%d at %I:%M %p ET')
-    previous_day_name = previous_trading_day.strftime('%A')
-
-    html_parts = [
-        f"<h2>Daily Gap Analysis - {datetime.now().strftime('%Y-%m-%d')}</h2>",
-        f"<p><strong>Data Source:</strong> Yahoo Finance</p>",
-        f"<p><strong>Current Timestamp:</strong> {current_time_str}</p>",
-        f"<p><strong>Previous Close Timestamp:</strong> {previous_day_name}, {previous_trading_day.strftime('%Y-%m-%d')} at ~4:00 PM ET</p>",
-        f"<p><strong>Gap Calculation:</strong> Current price vs Previous close price</p>",
-        f"<p><strong>Gap Down Threshold:</strong> ≤ {cfg['MIN_GAP_DOWN_PCT']}%</p>",
-        f"<p><strong>Gap Up Threshold:</strong> ≥ {cfg['MIN_GAP_UP_PCT']}%</p>",
-        f"<p><strong>Total Stocks Analyzed:</strong> {len(all_data)}</p>",
-        build_html_table(gap_downs, f"Gap Down Stocks", 0),
-        build_html_table(gap_ups, f"Gap Up Stocks", 0),
-        "<p><em>Complete data with all stocks attached as Excel file with highlighting.</em></p>"
-    ]
-
-    html = "".join(html_parts)
+    def build_html_body():
+        """Build the email body: run details followed by the gap down/up tables"""
+        # Build HTML content with the scan's timestamp info
+        prev_trading_day = data.get("prev_trading_day") or previous_trading_day(now_et)
+
+        # Format the timestamps for display
+        current_time_str = now_et.strftime('%A, %Y-%m-%d at %I:%M %p ET')
+        previous_day_name = prev_trading_day.strftime('%A')
+
+        html_parts = [
+            f"<h2>Daily Gap Analysis - {now_et:%Y-%m-%d}</h2>",
+            f"<p><strong>Data Source:</strong> Yahoo Finance</p>",
+            f"<p><strong>Current Timestamp:</strong> {current_time_str}</p>",
+            f"<p><strong>Previous Close Timestamp:</strong> {previous_day_name}, {prev_trading_day.strftime('%Y-%m-%d')} at ~4:00 PM ET</p>",
+            f"<p><strong>Gap Calculation:</strong> Current price vs Previous close price</p>",
+            f"<p><strong>Gap Down Threshold:</strong> ≤ {cfg['MIN_GAP_DOWN_PCT']}%</p>",
+            f"<p><strong>Gap Up Threshold:</strong> ≥ {cfg['MIN_GAP_UP_PCT']}%</p>",
+            f"<p><strong>Total Stocks Analyzed:</strong> {len(all_data)}</p>",
+            build_html_table(gap_downs, f"Gap Down Stocks", 0),
+            build_html_table(gap_ups, f"Gap Up Stocks", 0),
+            "<p><em>Complete data with all stocks attached as Excel file with highlighting.</em></p>"
+        ]
+
+        return "".join(html_parts)
 
     # Create subject line with proper format: [Daily Gaps] [DD/MM/YYYY] [x gap down, x gap up, stocks]
-    today_formatted = datetime.now().strftime('%d/%m/%Y')
+    today_formatted = now_et.strftime('%d/%m/%Y')
     total_stocks = len(all_data)
     subject = f"[Daily Gaps] [{today_formatted}] [{len(gap_downs)} gap down, {len(gap_ups)} gap up, {total_stocks} stocks]"
 
@@ -442,89 +635,60 @@ def send_email(cfg, data, to_emails=None):
             sys.exit(3)
 
         # Create Excel attachment with highlighted rows
-        import pandas as pd
-
-        # Sort all data by gap percentage (most negative first) for better organization
-        sorted_data = sorted(all_data, key=lambda x: x['gap_pct'])
+        # all_data comes from the scan already sorted by gap percentage (most negative first)
+        sorted_data = all_data
 
-        # Prepare data for DataFrame
-        excel_data = []
+        # Prepare data for DataFrame, building each Excel column in one pass
         print(f"\nPreparing Excel data for {len(sorted_data)} stocks...")
 
-        for i, row in enumerate(sorted_data):
-            dollar_change = row['today_current'] - row['prev_close']
-
-            excel_row = {
-                "Ticker": row["ticker"],
-                "Previous_Close": round(row['prev_close'], 2),
-                "Today_Current": round(row['today_current'], 2),
-                "Dollar_Change": round(dollar_change, 2),
-                "Gap_Percent": round(row['gap_pct'], 2),
-                "Data_Source": row.get('data_source', 'current-minute').replace('-', '_').upper(),
-                "_gap_raw": row['gap_pct']  # Keep for highlighting logic
-            }
-            excel_data.append(excel_row)
-
-            # Debug: Print first few rows
-            if i < 5:
-                gap_status = "GAP_DOWN" if row['gap_pct'] <= cfg['MIN_GAP_DOWN_PCT'] else "GAP_UP" if row['gap_pct'] >= cfg['MIN_GAP_UP_PCT'] else "NORMAL"
-                print(f"Row {i}: {row['ticker']} - Gap: {row['gap_pct']:+.2f}% ({gap_status})")
-
-        # Create DataFrame
-        df = pd.DataFrame(excel_data)
-
-        # Remove the helper column for display
-        display_df = df.drop('_gap_raw', axis=1)
-
-        print(f"\nExcel DataFrame shape: {display_df.shape}")
-        print(f"Excel DataFrame columns: {list(display_df.columns)}")
-        print(f"\nFirst 5 rows:")
-        print(display_df.head().to_string(index=False))
-
-        # Define highlighting function
-        def highlight_gaps(row):
-            # Get the raw gap value for this row
-            gap_pct = df.loc[row.name, '_gap_raw']
-
-            if gap_pct <= cfg['MIN_GAP_DOWN_PCT']:
-                # Red background for gap downs
-                return ['background-color: #ffcccc'] * len(row)
-            elif gap_pct >= cfg['MIN_GAP_UP_PCT']:
-                # Green background for gap ups
-                return ['background-color: #ccffcc'] * len(row)
-            else:
-                # White background for normal gaps
-                return ['background-color: white'] * len(row)
-
-        # Apply styling to the display DataFrame
-        styled_df = display_df.style.apply(highlight_gaps, axis=1)
+        display_df = sorted_data.assign(
+            Ticker=lambda d: d.ticker,
+            Previous_Close=lambda d: d.prev_close.round(2),
+            Today_Current=lambda d: d.today_current.round(2),
+            Dollar_Change=lambda d: d.dollar_change.round(2),
+            Gap_Percent=lambda d: d.gap_pct,
+            Data_Source=lambda d: d.data_source.fillna('current-minute').str.replace('-', '_').str.upper(),
+        )[["Ticker", "Previous_Close", "Today_Current", "Dollar_Change", "Gap_Percent", "Data_Source"]]
+        display_df = display_df.reset_index(drop=True)
+
+        # Thresholds and raw gaps bound once for highlighting and counts
+        gap_down_thr = cfg['MIN_GAP_DOWN_PCT']
+        gap_up_thr = cfg['MIN_GAP_UP_PCT']
+        raw_gaps = sorted_data["gap_pct"].to_numpy()
+
+        # The scan already printed the top gaps; the full preview is debug-only
+        if cfg["DEBUG_CSV"]:
+            print(f"\nExcel DataFrame shape: {display_df.shape}")
+            print(f"Excel DataFrame columns: {list(display_df.columns)}")
+            print(f"\nFirst 5 rows:")
+            print(display_df.head().to_string(index=False))
 
         # Count highlighted rows
-        gap_down_count = len([s for s in sorted_data if s['gap_pct'] <= cfg['MIN_GAP_DOWN_PCT']])
-        gap_up_count = len([s for s in sorted_data if s['gap_pct'] >= cfg['MIN_GAP_UP_PCT']])
+        gap_down_count = int((raw_gaps <= gap_down_thr).sum())
+        gap_up_count = int((raw_gaps >= gap_up_thr).sum())
         print(f"\nHighlighting: {gap_down_count} red rows (gap down), {gap_up_count} green rows (gap up)")
 
-        # Save to Excel file with highlighting
-        excel_filename = f"gap_analysis_{datetime.now().strftime('%Y%m%d')}.xlsx"
-        styled_df.to_excel(excel_filename, index=False, engine='openpyxl')
-
-        # Also save debug CSV
-        csv_content = display_df.to_csv(index=False)
-        with open(f"debug_gap_analysis_{datetime.now().strftime('%Y%m%d')}.csv", 'w', encoding='utf-8') as debug_file:
-            debug_file.write(csv_content)
-
-        print(f"Excel file with highlighting saved as: {excel_filename}")
-        print(f"Debug CSV also saved for reference")
+        # Write the Excel file with highlighting to memory on a worker thread
+        # while the HTML body is built
+        excel_filename = f"gap_analysis_{date_str}.xlsx"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            excel_future = executor.submit(_build_excel_bytes, display_df, gap_down_thr, gap_up_thr)
+            html = build_html_body()
+            excel_bytes = excel_future.result()
+        excel_base64 = base64.b64encode(excel_bytes).decode('ascii')
 
-        # Read the Excel file as bytes for email attachment
-        with open(excel_filename, 'rb') as f:
-            excel_bytes = f.read()
-        excel_base64 = base64.b64encode(excel_bytes).decode('utf-8')
+        if cfg["DEBUG_SAVE_XLSX"]:
+            with open(excel_filename, 'wb') as f:
+                f.write(excel_bytes)
+            print(f"Excel file with highlighting saved as: {excel_filename}")
 
-        # csv_content is already created above
+        # Also save debug CSV
+        if cfg["DEBUG_CSV"]:
+            # Stream rows straight to the file instead of building the whole CSV as one string
+            display_df.round({"Gap_Percent": 2}).to_csv(f"debug_gap_analysis_{date_str}.csv",
+                                                        index=False, encoding='utf-8', chunksize=500)
 
-        # Set the API key
-        resend.api_key = cfg["RESEND_API_KEY"]
+            print(f"Debug CSV also saved for reference")
 
         # Send the email using Resend with attachment
         from_name = "Market Mage"
@@ -538,18 +702,20 @@ def send_email(cfg, data, to_emails=None):
             "html": html,
             "attachments": [
                 {
-                    "filename": f"gap_analysis_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                    "filename": excel_filename,
                     "content": excel_base64,
                     "type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 }
             ]
         }
 
-        email = resend.Emails.send(params)
+        email = _send_with_retry(params)
         print(f"Email sent successfully! ID: {email['id']}")
         print(f"Excel attachment included with ALL {len(all_data)} stocks")
         print(f"Row highlighting: {gap_down_count} red (gap-down), {gap_up_count} green (gap-up)")
-        print(f"Local Excel and CSV files created for verification")
+        saved_files = [name for name, enabled in (("Excel", cfg["DEBUG_SAVE_XLSX"]), ("CSV", cfg["DEBUG_CSV"])) if enabled]
+        if saved_files:
+            print(f"Local {' and '.join(saved_files)} files created for verification")
 
     except Exception as e:
         print(f"ERROR sending email: {e}", file=sys.stderr)
@@ -570,6 +736,9 @@ def main():
         cfg = load_env()
         print(f"Configuration loaded successfully. Using Yahoo Finance data source.")
 
+        # The Resend SDK reads a module-level key; set it once for every send in this run
+        resend.api_key = cfg["RESEND_API_KEY"]
+
         print("Scanning for gap opportunities...")
         data = yahoo_gap_scan(cfg)
 
@@ -577,6 +746,10 @@ def main():
             print("ERROR: Data collection failed. Exiting without sending email.", file=sys.stderr)
             sys.exit(1)
 
+        if cfg["SKIP_EMPTY_REPORTS"] and data["gap_downs"].empty and data["gap_ups"].empty:
+            print("No gap-down or gap-up stocks found; skipping email (SKIP_EMPTY_REPORTS=true)")
+            return
+
         print(f"Data collection complete. Sending email...")
 
         if command == 'email':
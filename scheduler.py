@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 """
-Nightly Gap Analysis Scheduler
-Runs the gap analysis at midnight EST and sends email reports
+Gap Analysis Scheduler (local development)
+Runs the gap analysis daily at 8:00 AM and sends email reports.
+Deployments use cron instead (see crontab), which needs no long-running process.
 """
 import schedule
 import time
 import os
 import sys
 from datetime import datetime
-import pytz
 
 # Add current directory to path so we can import our modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -31,20 +31,26 @@ def main():
     print("Scheduling gap analysis for 8:00 AM CT daily")
 
     # Schedule the job to run at 8:00 AM CT
-    # Note: Using CT timezone handling
-    ct_tz = pytz.timezone('US/Central')
+    # Note: schedule uses the host's local time, so run this with TZ=America/Chicago
     schedule.every().day.at("08:00").do(job)
 
-    # Also run immediately on startup for testing (remove this in production)
-    print("Running initial gap analysis...")
-    job()
+    # Optionally run immediately on startup for testing
+    if os.getenv("RUN_ON_STARTUP", "false").lower() == "true":
+        print("Running initial gap analysis...")
+        job()
 
     print("Scheduler started. Waiting for scheduled runs...")
 
-    # Keep the script running
+    # Sleep until the next scheduled run instead of waking every minute
     while True:
+        idle = schedule.idle_seconds()
+        if idle is None:
+            # No jobs scheduled
+            time.sleep(3600)
+            continue
+        if idle > 0:
+            time.sleep(idle)
         schedule.run_pending()
-        time.sleep(60)  # Check every minute
 
 if __name__ == "__main__":
     main()
@@ -2,24 +2,24 @@
 """
 Simple test script to verify Resend API key
 """
-import os
-from dotenv import load_dotenv
+from gap_down_email import load_env, get_personal_emails
 import resend
 
 def test_resend():
-    load_dotenv()
+    # Same settings and validation as the real report
+    cfg = load_env()
 
-    api_key = os.getenv('RESEND_API_KEY')
-    email_from = os.getenv('EMAIL_FROM')
-    email_to = os.getenv('EMAIL_TO')
+    api_key = cfg['RESEND_API_KEY']
+    email_from = cfg['EMAIL_FROM']
+    email_to = get_personal_emails(cfg)
 
-    if not api_key or not email_from or not email_to:
-        print("ERROR: Missing required environment variables")
+    if not email_to:
+        print("ERROR: Missing PERSONAL_EMAILS recipient")
         return False
 
     print(f"Testing Resend API key: {api_key[:10]}...")
     print(f"From: {email_from}")
-    print(f"To: {email_to}")
+    print(f"To: {', '.join(email_to)}")
 
     try:
         # Set the API key
@@ -28,7 +28,7 @@ def test_resend():
         # Send a simple test email
         params = {
             "from": email_from,
-            "to": [email_to],
+            "to": email_to,
             "subject": "Resend API Test",
             "html": "<p>This is a test email to verify your Resend API key is working.</p>"
         }